@@ -1,67 +1,444 @@
-from flask import Flask, request, jsonify
+import os
+
+# When running under gunicorn's gevent worker (GEVENT=1), patch the stdlib
+# before requests/supabase are imported so their blocking sockets yield to
+# the event loop; one worker then multiplexes hundreds of in-flight
+# Supabase/Ollama calls instead of holding a thread per request.
+if os.environ.get("GEVENT", "").lower() in ("1", "true", "yes"):
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, request, jsonify, Response, stream_with_context
 import joblib
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 load_dotenv()
 from flask_cors import CORS
+from flask_compress import Compress
 
 from supabase import create_client, Client
+from cachetools import TTLCache
+from collections import namedtuple
+
+# Local JWT verification is optional; without PyJWT (or the project secret)
+# token checks fall back to the GoTrue roundtrip.
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+# orjson encodes 3-10x and decodes 2-3x faster than stdlib json, which adds
+# up on multi-KB chat histories; fall back to stdlib when it is missing.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    json_loads = json.loads
+    json_dumps = json.dumps
 
 app = Flask(__name__)
 CORS(app)
 
+if orjson is not None:
+    from flask.json.provider import JSONProvider
+
+    class ORJSONProvider(JSONProvider):
+        """Back jsonify/request.json with orjson instead of stdlib json."""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = ORJSONProvider(app)
+
+# Diet plans and chat replies can be tens of KB of markdown; gzip anything
+# over 500B so mobile clients are not paying for uncompressed JSON/SSE.
+app.config["COMPRESS_MIMETYPES"] = ["application/json", "text/html", "text/event-stream"]
+app.config["COMPRESS_MIN_SIZE"] = 500
+Compress(app)
+
+@app.after_request
+def set_cache_control(response):
+    # Everything here is per-user dynamic data behind a bearer token; make
+    # sure no intermediary caches it.
+    if "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 OLLAMA_MODEL_ID = os.environ.get("OLLAMA_MODEL_ID")
 OLLAMA_API_HOST = os.environ.get("OLLAMA_API_HOST", "http://localhost:11434")
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY environment variables")
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Pooled session so every chat call reuses the same TCP connection to Ollama
+# instead of paying a fresh connect (and TLS handshake for remote hosts).
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+# Ask remote Ollama deployments to gzip their (large) response bodies too
+_session.headers["Accept-Encoding"] = "gzip"
+
 # Custom chat function to replace ollama-python client
 def chat(model, messages):
     """
     Send a chat request to Ollama API using the requests library
     """
     try:
-        response = requests.post(
+        response = _session.post(
             f"{OLLAMA_API_HOST}/api/chat",
-            json={"model": model, "messages": messages}
+            json={"model": model, "messages": messages, "stream": False},
+            stream=False,
+            timeout=(3, 120)
         )
         
-        result = response.json()
-        # Format response to match original ollama-python structure
-        class DotDict(dict):
-            """Dot notation access to dictionary attributes"""
-            __getattr__ = dict.get
-            __setattr__ = dict.__setitem__
-            __delattr__ = dict.__delitem__
-            
-        result_obj = DotDict(result)
-        result_obj.message = DotDict(result.get("message", {}))
-        return result_obj
+        return json_loads(response.content)
     except Exception as e:
         print(f"Error in chat function: {str(e)}")
         raise
 
-# Load trained models and scalers
-maternal_model = joblib.load("finalized_maternal_model.sav")
-maternal_scaler = joblib.load("scaleX.pkl")
+def chat_stream(model, messages):
+    """
+    Stream a chat response from Ollama, yielding content chunks as they arrive.
+    Keeps memory constant regardless of response length and gives the client
+    first-token latency instead of waiting for the whole generation.
+    """
+    response = _session.post(
+        f"{OLLAMA_API_HOST}/api/chat",
+        json={"model": model, "messages": messages, "stream": True},
+        stream=True,
+        timeout=(3, 120)
+    )
+    response.raise_for_status()
+    for line in response.iter_lines():
+        if not line:
+            continue
+        part = json_loads(line)
+        content = part.get("message", {}).get("content", "")
+        if content:
+            yield content
+        if part.get("done"):
+            break
+
+def wants_stream():
+    """True when the client asked for a server-sent event stream."""
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+class LockedTTLCache:
+    """
+    TTLCache guarded by a lock. cachetools caches are not thread-safe, and
+    the gthread deployment runs many threads per worker; unguarded
+    concurrent get/set/pop would corrupt the expiry bookkeeping.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
 
-# Load the trained model and scaler
-model_path = "fetal_health_model.sav"
-scaler_path = "scaleX1.pkl"
+    def get(self, key):
+        with self._lock:
+            return self._cache.get(key)
 
-with open(model_path, "rb") as model_file:
-    model = joblib.load(model_file)
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
 
-with open(scaler_path, "rb") as scaler_file:
-    scaler = joblib.load(scaler_file)
+    def pop(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+# supabase.auth.get_user is an HTTPS roundtrip to GoTrue on every protected
+# request, often the largest latency on a /predict_* call. JWTs stay valid for
+# up to an hour, so cache the lookup per token for a few minutes.
+_user_cache = LockedTTLCache(maxsize=10000, ttl=300)
+
+# Minimal stand-ins for the GoTrue response shape; the endpoints only ever
+# read user_data.user.id.
+_LocalUser = namedtuple("_LocalUser", ["id"])
+_LocalUserData = namedtuple("_LocalUserData", ["user"])
+
+def verify_token_local(token):
+    """
+    Verify a Supabase JWT locally with the project secret (HS256), skipping
+    the GoTrue roundtrip entirely. Returns None when local verification is
+    unavailable or the token fails to decode, so callers can fall back.
+    """
+    if jwt is None or not SUPABASE_JWT_SECRET:
+        return None
+    try:
+        claims = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], audience="authenticated")
+    except jwt.InvalidTokenError:
+        return None
+    return _LocalUserData(user=_LocalUser(id=claims["sub"]))
+
+def get_user_cached(token):
+    """Validate a token locally when possible, else against Supabase; cached per token."""
+    user_data = _user_cache.get(token)
+    if user_data is None:
+        user_data = verify_token_local(token) or supabase.auth.get_user(token)
+        if user_data:
+            _user_cache.set(token, user_data)
+    return user_data
+
+CHAT_SYSTEM_PROMPT = {'role':'user','content':"You are prenova, an AI assistant that is here to help you with the user's pregnancy journey. You will only provide information that is accurate and helpful to the user. You will not provide any medical advice or diagnosis. You will also not provide any information that is not related to pregnancy. You will be polite and respectful to the user at all times. You will be rewarded for providing accurate and helpful information and penalized for providing inaccurate or unhelpful information. You will be deactivated if you provide inaccurate or unhelpful information repeatedly."}
+
+# Chat history used to live as one growing chat_history JSON blob in the
+# chats table, re-read and rewritten in full on every turn (quadratic bytes
+# over a conversation). It now lives in the append-only chat_messages table
+# (UID, turn_idx, role, content): each turn bulk-inserts only its new rows.
+# A per-user cache serves read-only paths (GET /chat); it is filled on load
+# and invalidated on save. Turn-building paths must NOT use it: the cache is
+# per-process, so under multiple gunicorn workers a warm entry can miss
+# turns a sibling worker persisted, and appending on top of it would both
+# drop those turns from the prompt and reuse their turn_idx values.
+# Cache entries are {'messages': [...], 'persisted': n} where n counts how
+# many leading messages are already stored in chat_messages.
+_history_cache = LockedTTLCache(maxsize=1000, ttl=600)
+
+def load_chat_history(uid, use_cache=True):
+    """
+    Return this user's chat history. With use_cache=False the authoritative
+    rows are always re-read and the result is kept private to the caller,
+    which POST /chat relies on before building a new turn.
+    """
+    if use_cache:
+        entry = _history_cache.get(uid)
+        if entry is not None:
+            return entry
+    rows = supabase.table('chat_messages').select('turn_idx, role, content').eq('UID', uid).order('turn_idx').execute()
+    if rows.data:
+        entry = {
+            'messages': [{'role': r['role'], 'content': r['content']} for r in rows.data],
+            'persisted': len(rows.data),
+        }
+    else:
+        # Conversations started before chat_messages existed still live as a
+        # blob in the chats table; persisted=0 makes the next save migrate
+        # the whole history into chat_messages in one bulk insert.
+        chat_data = supabase.table('chats').select().eq('UID', uid).order('created_at', desc=True).limit(1).execute()
+        if chat_data.data:
+            entry = {'messages': chat_data.data[0]['chat_history'], 'persisted': 0}
+        else:
+            entry = {'messages': [dict(CHAT_SYSTEM_PROMPT)], 'persisted': 0}
+    if use_cache:
+        _history_cache.set(uid, entry)
+    return entry
+
+# Without a cap, every /chat turn replays the whole conversation to Ollama,
+# so token cost and generation latency grow without bound. Send the priming
+# prompt plus a sliding window of recent turns; the full history still
+# persists in chat_messages and is what /chat GET returns.
+CHAT_HISTORY_WINDOW = 40
+
+def bounded_history(messages):
+    """The priming prompt plus the most recent turns, capped at the window."""
+    if len(messages) <= CHAT_HISTORY_WINDOW:
+        return messages
+    return [messages[0]] + messages[-(CHAT_HISTORY_WINDOW - 1):]
+
+def save_chat_history(uid, entry):
+    """Bulk-insert any messages not yet persisted to chat_messages."""
+    messages = entry['messages']
+    start = entry['persisted']
+    new_rows = [
+        {'UID': uid, 'turn_idx': start + i, 'role': m['role'], 'content': m['content']}
+        for i, m in enumerate(messages[start:])
+    ]
+    if new_rows:
+        supabase.table('chat_messages').insert(new_rows).execute()
+        # Advance the watermark so a repeated save of this entry can never
+        # re-insert rows that are already in the table.
+        entry['persisted'] = len(messages)
+        # Invalidate rather than re-cache: the cache is per-process and
+        # gunicorn runs several workers, so a sibling worker may persist the
+        # next turn. Keeping a warm entry here would both drop those turns
+        # from the prompt and reuse turn_idx values the sibling already
+        # wrote. The next load re-reads the authoritative rows instead.
+        _history_cache.pop(uid)
+
+# Vitals/CTG rows are written off the request path: the prediction returns
+# immediately and a background thread bulk-inserts queued rows every 200ms
+# (or once 100 pile up). Losing at most one flush window of telemetry on a
+# crash is acceptable for this workload.
+_insert_queue = queue.Queue()
+
+def queue_insert(table, row):
+    """Queue a row for background bulk insert into the given table."""
+    _insert_queue.put((table, row))
+
+def _insert_flusher():
+    pending = {}
+    count = 0
+    while True:
+        try:
+            table, row = _insert_queue.get(timeout=0.2)
+            pending.setdefault(table, []).append(row)
+            count += 1
+            if count < 100:
+                continue
+        except queue.Empty:
+            if not pending:
+                continue
+        for table, rows in pending.items():
+            try:
+                supabase.table(table).insert(rows).execute()
+            except Exception as e:
+                print(f"Background insert into {table} failed: {str(e)}")
+        pending = {}
+        count = 0
+
+threading.Thread(target=_insert_flusher, daemon=True).start()
+
+# Load trained models and scalers. The four pickles deserialize
+# independently, so load them in parallel to cut worker startup time, and
+# memory-map any numpy arrays inside so forked gunicorn workers share the
+# pages read-only instead of each holding a private copy.
+def _load_artifact(path):
+    return joblib.load(path, mmap_mode="r")
+
+with ThreadPoolExecutor(max_workers=4) as _loader:
+    _maternal_model = _loader.submit(_load_artifact, "finalized_maternal_model.sav")
+    _maternal_scaler = _loader.submit(_load_artifact, "scaleX.pkl")
+    _fetal_model = _loader.submit(_load_artifact, "fetal_health_model.sav")
+    _fetal_scaler = _loader.submit(_load_artifact, "scaleX1.pkl")
+
+maternal_model = _maternal_model.result()
+maternal_scaler = _maternal_scaler.result()
+model = _fetal_model.result()
+scaler = _fetal_scaler.result()
+
+# Fused scale+predict helpers so each endpoint makes exactly one call into the
+# inference path. The pickled models are XGBoost/LightGBM boosters (not plain
+# sklearn estimators), so an ONNX export would drag in onnxmltools for little
+# gain; the boosters' own predictors are already compiled.
+#
+# Going through the sklearn wrappers re-runs Python-side input validation on
+# every call, which dominates a single-row predict, so hit the compiled
+# boosters directly and take the argmax of the class probabilities ourselves.
+maternal_booster = maternal_model.get_booster()
+fetal_booster = model.booster_
+fetal_classes = model.classes_
+
+# Inline the scaler parameters: a 1-row transform() spends most of its time
+# in sklearn's check_array/bookkeeping rather than arithmetic. The maternal
+# scaler is a StandardScaler ((x - mean) / scale) and the fetal one a
+# MinMaxScaler (x * scale + min), so apply the same affine maps with plain
+# numpy using arrays pulled from the fitted scalers once at import.
+#
+# Everything runs in float32: both boosters score in single precision anyway
+# (XGBoost's inplace_predict is float32-native), so float64 rows only doubled
+# memory traffic on every predict for no accuracy gain.
+assert maternal_scaler.with_mean and maternal_scaler.with_std
+_maternal_mean = np.asarray(maternal_scaler.mean_, dtype=np.float32)
+_maternal_scale = np.asarray(maternal_scaler.scale_, dtype=np.float32)
+_fetal_scale = np.asarray(scaler.scale_, dtype=np.float32)
+_fetal_min = np.asarray(scaler.min_, dtype=np.float32)
+
+def _predict_maternal_batch(rows):
+    probs = maternal_booster.inplace_predict((rows - _maternal_mean) / _maternal_scale)
+    return np.argmax(probs, axis=1)
+
+def _predict_fetal_batch(rows):
+    probs = fetal_booster.predict(rows * _fetal_scale + _fetal_min, validate_features=False)
+    return fetal_classes[np.argmax(probs, axis=1)]
+
+class BatchPredictor:
+    """
+    Coalesces concurrent single-row predictions into one batched model call.
+    Requests push their feature row and block on a Future; a background
+    thread drains the queue every few ms (or once 64 rows pile up) and runs
+    scale+predict once on the stacked matrix. Booster cost is near-constant
+    in N for small batches, so concurrent requests get close to batch-size
+    speedup, while a lone request only risks the short coalescing window.
+    """
+
+    def __init__(self, predict_batch, max_batch=64, max_wait=0.005):
+        self._predict_batch = predict_batch
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, row):
+        future = Future()
+        self._queue.put((row, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            rows = np.vstack([row for row, _ in batch])
+            try:
+                results = self._predict_batch(rows)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+maternal_batcher = BatchPredictor(_predict_maternal_batch)
+fetal_batcher = BatchPredictor(_predict_fetal_batch)
+
+# Request-invariant lookup tables, hoisted so they are built once at import
+# instead of on every call.
+MATERNAL_KEYS = ("age", "systolic_bp", "diastolic_bp", "blood_glucose", "body_temp", "heart_rate")
+MATERNAL_RISK_LEVELS = {0: "Normal", 1: "Suspect", 2: "Pathological"}
+FETAL_HEALTH_STATUS = {1: "Normal", 2: "Suspect", 3: "Pathological"}
+FETAL_FEATURE_NAMES = (
+    'baseline_value', 'accelerations', 'fetal_movement', 'uterine_contractions',
+    'light_decelerations', 'severe_decelerations', 'prolonged_decelerations',
+    'abnormal_short_term_variability', 'mean_value_of_short_term_variability',
+    'percentage_of_time_with_abnormal_long_term_variability', 'mean_value_of_long_term_variability',
+    'histogram_width', 'histogram_min', 'histogram_max', 'histogram_number_of_peaks'
+)
+
+def predict_maternal_row(features):
+    """Scale and classify one (1, 6) maternal vitals row via the batcher."""
+    return int(maternal_batcher.predict(features))
+
+def predict_fetal_row(features):
+    """Scale and classify one (1, 15) CTG feature row via the batcher."""
+    return int(fetal_batcher.predict(features))
 
 @app.route("/create_doctor_profile", methods=["POST"])
 def create_doctor_profile():
@@ -92,26 +469,18 @@ def predict_maternal():
         
         token = auth_header.split(' ')[1]
 
-        user_data = supabase.auth.get_user(token)
+        user_data = get_user_cached(token)
         print("FREE TOKEN", token)
 
         if not user_data:
             return {'error': 'Invalid token'}, 401
 
         data = request.json
-        features = [
-            float(data["age"]),
-            float(data["systolic_bp"]),
-            float(data["diastolic_bp"]),
-            float(data["blood_glucose"]),
-            float(data["body_temp"]),
-            float(data["heart_rate"])
-        ]
-        features = np.array(features).reshape(1, -1)
-        scaled_features = maternal_scaler.transform(features)
-        prediction = maternal_model.predict(scaled_features)
-        risk_mapping = {0: "Normal", 1: "Suspect", 2: "Pathological"}
-        risk_level = risk_mapping[int(prediction[0])]
+        # Build the feature row in one shot instead of six float() calls plus
+        # an intermediate list -> ndarray reparse.
+        features = np.fromiter((data[k] for k in MATERNAL_KEYS), dtype=np.float32, count=6).reshape(1, 6)
+        prediction = predict_maternal_row(features)
+        risk_level = MATERNAL_RISK_LEVELS[prediction]
 
         # Insert into vitals table   
         vital_data = {
@@ -121,9 +490,9 @@ def predict_maternal():
             'blood_glucose': data["blood_glucose"],
             'body_temp': data["body_temp"],
             'heart_rate': data["heart_rate"],
-            'prediction': int(prediction[0])
+            'prediction': prediction
         }
-        result = supabase.table('vitals').insert(vital_data).execute()
+        queue_insert('vitals', vital_data)
 
         return jsonify({"prediction": risk_level})
     except Exception as e:
@@ -141,7 +510,7 @@ def predict_fetal():
         
         # Validate Token & Get User Data
         try:
-            user_data = supabase.auth.get_user(token)
+            user_data = get_user_cached(token)
             if not user_data or not user_data.user:
                 return jsonify({'error': 'Invalid token'}), 401
         except Exception:
@@ -152,41 +521,25 @@ def predict_fetal():
         if not data or "features" not in data:
             return jsonify({'error': 'Missing required feature data'}), 400
 
-        # Ensure feature list has correct length
-        features = np.array(data["features"], dtype=float)
-        expected_feature_length = 15  # Adjust as needed
-        if features.shape[0] != expected_feature_length:
-            return jsonify({'error': f'Invalid feature length, expected {expected_feature_length}'}), 400
-        
-        features = features.reshape(1, -1)
+        # Ensure feature list has correct length (asarray avoids a copy when
+        # the client already sent a flat numeric list)
+        features = np.asarray(data["features"], dtype=np.float32)
+        if features.shape[0] != len(FETAL_FEATURE_NAMES):
+            return jsonify({'error': f'Invalid feature length, expected {len(FETAL_FEATURE_NAMES)}'}), 400
 
-        # Scale features
-        try:
-            scaled_features = scaler.transform(features)
-        except Exception as e:
-            return jsonify({'error': f'Feature scaling failed: {str(e)}'}), 500
+        features = features.reshape(1, -1)
 
-        # Make Prediction
+        # Scale + predict in one step
         try:
-            prediction = int(model.predict(scaled_features)[0])  # Ensure Python int
+            prediction = predict_fetal_row(features)
         except Exception as e:
             return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
 
         # Map prediction to health status
-        health_status = {1: "Normal", 2: "Suspect", 3: "Pathological"}
-        prediction_result = health_status.get(prediction, "Unknown")
-
-        # Define Feature Names
-        feature_names = [
-            'baseline_value', 'accelerations', 'fetal_movement', 'uterine_contractions',
-            'light_decelerations', 'severe_decelerations', 'prolonged_decelerations',
-            'abnormal_short_term_variability', 'mean_value_of_short_term_variability',
-            'percentage_of_time_with_abnormal_long_term_variability', 'mean_value_of_long_term_variability',
-            'histogram_width', 'histogram_min', 'histogram_max', 'histogram_number_of_peaks'
-        ]
+        prediction_result = FETAL_HEALTH_STATUS.get(prediction, "Unknown")
 
         # Map features to dictionary and ensure all values are Python types
-        feature_dict = {k: float(v) for k, v in zip(feature_names, features.flatten())}
+        feature_dict = {k: float(v) for k, v in zip(FETAL_FEATURE_NAMES, features.flatten())}
 
         # Prepare data for Supabase
         ctg_data = {
@@ -195,11 +548,8 @@ def predict_fetal():
             'prediction': prediction
         }
 
-        # Insert Data into Supabase
-        try:
-            supabase.table('ctg').insert(ctg_data).execute()
-        except Exception as e:
-            return jsonify({'error': f'Database insert failed: {str(e)}'}), 500
+        # Insert Data into Supabase off the response path
+        queue_insert('ctg', ctg_data)
 
         return jsonify({"prediction": prediction, "status": prediction_result})
 
@@ -217,24 +567,40 @@ def pregnancy_diet():
         
         token = auth_header.split(' ')[1]
 
-        user_data = supabase.auth.get_user(token)
+        user_data = get_user_cached(token)
 
         if not user_data:
             return {'error': 'Invalid token'}, 401
         
         prompt = f"You are a professional dietician and nutritionist. You suggest excellent diet plans for pregnant women that look after their well being and growth. You will now suggest a diet plan for a {data['trimester']} trimester pregnant woman weighing about {data['weight']} kg, who is feeling {data['health_conditions']} and has strict dietary preferences as follows: {data['dietary_preference']}. Do not suggest any foods that can cause harm or go against the dietary preferences. Suggest both a vegetarian only and a non-vegetarian diet plan separately for her and just give the plan."
 
-        response = chat(model=OLLAMA_MODEL_ID, messages=[
-            {'role':'user','content':prompt}
-        ])
-
-        # Store the diet plan in the database
+        messages = [{'role':'user','content':prompt}]
+
+        if wants_stream():
+            def generate():
+                buffer = []
+                for chunk in chat_stream(model=OLLAMA_MODEL_ID, messages=messages):
+                    buffer.append(chunk)
+                    yield f"data: {json_dumps({'content': chunk})}\n\n"
+                # Store the diet plan once the stream finishes, off the
+                # response path
+                queue_insert('diet_plans', {
+                    'UID': user_data.user.id,
+                    'diet_plan': "".join(buffer) # Stored as markdown
+                })
+                yield "data: [DONE]\n\n"
+            return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+        response = chat(model=OLLAMA_MODEL_ID, messages=messages)
+
+        # Store the diet plan in the database without blocking the response
         diet_data = {
             'UID': user_data.user.id,
-            'diet_plan': response.message.content # Stored as markdown
+            'diet_plan': response["message"]["content"] # Stored as markdown
         }
+        queue_insert('diet_plans', diet_data)
 
-        return jsonify({"diet_plan": response.message.content})
+        return jsonify({"diet_plan": response["message"]["content"]})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -245,15 +611,15 @@ def chatbot_get():
         return {'error': 'No valid token provided'}, 401
     
     token = auth_header.split(' ')[1]
-    user_data = supabase.auth.get_user(token)
+    user_data = get_user_cached(token)
 
     if not user_data:
         return {'error': 'Invalid token'}, 401
     
-    # Get the chat from the database
-    chat_data = supabase.table('chats').select().eq('UID', user_data.user.id).order('created_at', desc=True).limit(1).execute()
+    # Get the chat history (cache-warm for active conversations)
+    entry = load_chat_history(user_data.user.id)
 
-    return jsonify(chat_data.data[0]['chat_history'])
+    return jsonify(entry['messages'])
 
 @app.route("/chat", methods=["POST"])
 def chatbot():
@@ -267,31 +633,47 @@ def chatbot():
         token = auth_header.split(' ')[1]
         print("FREE TOKEN YALL", token)
 
-        user_data = supabase.auth.get_user(token)
+        user_data = get_user_cached(token)
 
         if not user_data:
             return {'error': 'Invalid token'}, 401
         
-        # Get the chat from the database
-        chat_data = supabase.table('chats').select().eq('UID', user_data.user.id).order('created_at', desc=True).limit(1).execute()
+        # Re-read the authoritative history before building a turn: a cached
+        # entry could miss turns another worker persisted, and the private
+        # copy keeps concurrent POSTs from appending to a shared list.
+        entry = load_chat_history(user_data.user.id, use_cache=False)
+        chat_history = entry['messages']
+
+        # Build the prompt without mutating the entry yet: if the Ollama
+        # call fails nothing is appended or persisted, so a retry starts
+        # from a clean turn. Both turns are committed only after generation
+        # succeeds.
+        user_msg = {'role':'user','content':data['message']}
+        prompt_messages = bounded_history(chat_history + [user_msg])
+
+        if wants_stream():
+            def generate():
+                # Accumulate the streamed reply so the history can be saved
+                # once the generation finishes, off the first-token path.
+                buffer = []
+                for chunk in chat_stream(model=OLLAMA_MODEL_ID, messages=prompt_messages):
+                    buffer.append(chunk)
+                    yield f"data: {json_dumps({'content': chunk})}\n\n"
+                chat_history.append(user_msg)
+                chat_history.append({'role':'assistant','content':"".join(buffer)})
+                save_chat_history(user_data.user.id, entry)
+                yield "data: [DONE]\n\n"
+            return Response(stream_with_context(generate()), mimetype="text/event-stream")
 
-        print("Chat data:", chat_data)
-        if not chat_data.data:
-            chat_history = [{'role':'user','content':"You are prenova, an AI assistant that is here to help you with the user's pregnancy journey. You will only provide information that is accurate and helpful to the user. You will not provide any medical advice or diagnosis. You will also not provide any information that is not related to pregnancy. You will be polite and respectful to the user at all times. You will be rewarded for providing accurate and helpful information and penalized for providing inaccurate or unhelpful information. You will be deactivated if you provide inaccurate or unhelpful information repeatedly."}]
-        else:
-            chat_history = chat_data.data[0]['chat_history']
-
-        prompt = data['message']
-        chat_history.append({'role':'user','content':prompt})
-        
         # Get response from Ollama
-        response = chat(model=OLLAMA_MODEL_ID, messages=chat_history)
+        response = chat(model=OLLAMA_MODEL_ID, messages=prompt_messages)
 
         # Update the chat history
-        chat_history.append({'role':'assistant','content':f"{response.message.content}"})
-        result = supabase.table('chats').upsert({'UID': user_data.user.id, 'chat_history': chat_history}).execute()
+        chat_history.append(user_msg)
+        chat_history.append({'role':'assistant','content':response["message"]["content"]})
+        save_chat_history(user_data.user.id, entry)
 
-        return jsonify({"response": response.message.content})
+        return jsonify({"response": response["message"]["content"]})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -299,5 +681,14 @@ def chatbot():
 def ind():
     return "Hello governer"
 
+# Run with gunicorn so requests can overlap instead of queueing behind
+# Werkzeug's single-threaded dev server. The endpoints mostly block on
+# Supabase/Ollama I/O, so threaded workers scale well:
+#   gunicorn -w $(nproc) -k gthread --threads 16 --keep-alive 30 -b 0.0.0.0:5003 app:app
+# or, for I/O-heavy load, the gevent event loop (see the GEVENT guard at the
+# top of this file):
+#   GEVENT=1 gunicorn -w $(nproc) -k gevent --worker-connections 200 --keep-alive 30 -b 0.0.0.0:5003 app:app
+# Models are loaded at import time, so forked workers share them copy-on-write.
 if __name__ == "__main__":
-    app.run(debug=False,port=5003,host="0.0.0.0")
\ No newline at end of file
+    # Dev fallback only; use the gunicorn command above in production.
+    app.run(debug=False, port=5003, host="0.0.0.0")
\ No newline at end of file